@@ -0,0 +1 @@
+# Keeps the repo root importable (main_sql, locations) when running pytest.
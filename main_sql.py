@@ -1,9 +1,14 @@
 import requests
 import pandas as pd
+import numpy as np
 from datetime import datetime
 import time
 import os
-from sqlalchemy import create_engine, text
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, table, column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
 from locations import DISTRICTS, PUNJAB_MACRO_BBOX
 
 # --- CONFIGURATION ---
@@ -17,89 +22,165 @@ DB_CONNECTION_STR = os.environ.get("DATABASE_URL")
 if not all([NASA_KEY, OPENWEATHER_KEY, DB_CONNECTION_STR]):
     raise ValueError("Critical Error: Missing Environment Variables. Check your .env file or GitHub Secrets!")
 
+# One shared HTTP session so the ~45 weather/smog calls per run reuse
+# keep-alive connections instead of a fresh TCP+TLS handshake each time
+HTTP = requests.Session()
+OWM_BASE_URL = "https://api.openweathermap.org/data/2.5"
+OPENMETEO_URL = "https://api.open-meteo.com/v1/forecast"
+OPENMETEO_WIND_PARAMS = {"current": "wind_speed_10m,wind_direction_10m", "wind_speed_unit": "kmh"}
+
+# What a failed/garbled API call can raise (network error, bad JSON, missing fields).
+# Anything else is a real bug and should surface instead of being printed away.
+API_ERRORS = (requests.RequestException, ValueError, KeyError, IndexError, TypeError)
+
+# District coordinates as parallel arrays (same order as DISTRICTS), built once at import
+DISTRICT_NAMES = list(DISTRICTS)
+DISTRICT_LATS = np.array([DISTRICTS[c]['lat'] for c in DISTRICT_NAMES])
+DISTRICT_LONS = np.array([DISTRICTS[c]['lon'] for c in DISTRICT_NAMES])
+
+# Lightweight handle on the target table (no reflection round-trip needed)
+SMOG_METRICS = table(
+    "smog_metrics",
+    column("timestamp"), column("district"), column("pm2_5"), column("pm10"),
+    column("wind_speed"), column("wind_dir"), column("provincial_fire_load"),
+    column("local_fire_count"), column("local_fire_frp"),
+)
+
 # --- 1. GET FIRE DATA (Provincial Context) ---
 def get_provincial_fires():
     """Fetches ALL fires in Punjab once to avoid API rate limits."""
     url = f"https://firms.modaps.eosdis.nasa.gov/api/area/csv/{NASA_KEY}/VIIRS_NOAA20_NRT/{PUNJAB_MACRO_BBOX}/1"
     try:
-        df = pd.read_csv(url)
+        # Only parse the columns we use (the CSV carries ~14, e.g. scan/track/satellite)
+        # Coordinates stay float64 so fires sitting on a box edge classify exactly as before.
+        # 'confidence' only has 3 values (l/n/h), so a category makes the filter an int compare.
+        df = pd.read_csv(
+            url,
+            usecols=['latitude', 'longitude', 'frp', 'confidence'],
+            dtype={'confidence': 'category'}
+        )
         # Filter out low confidence fires ('l' = low)
         df = df[df['confidence'] != 'l']
         return df
-    except Exception as e:
+    # Fire data is optional enrichment: any network/HTTP failure (incl. a truncated
+    # download, which is an HTTPException rather than an OSError) or a non-CSV
+    # error body just means this hour's rows get zero fire counts
+    except (OSError, http.client.HTTPException, ValueError) as e:
         print(f"NASA Fetch Failed: {e}")
         return pd.DataFrame()
 
 # --- 2. CALCULATE LOCAL IMPACT ---
-def calculate_local_impact(city_lat, city_lon, all_fires_df):
-    """Filters provincial fires to find those within ~55km of the city."""
+def extract_fire_arrays(all_fires_df):
+    """Pulls the fire columns out as plain NumPy arrays (done once per run)."""
     if all_fires_df.empty:
-        return 0, 0
-
-    # Approx 0.5 deg = 55km radius box
-    lat_min, lat_max = city_lat - 0.5, city_lat + 0.5
-    lon_min, lon_max = city_lon - 0.5, city_lon + 0.5
-
-    local_fires = all_fires_df[
-        (all_fires_df['latitude'] >= lat_min) & 
-        (all_fires_df['latitude'] <= lat_max) & 
-        (all_fires_df['longitude'] >= lon_min) & 
-        (all_fires_df['longitude'] <= lon_max)
-    ]
+        empty = np.empty(0)
+        return empty, empty, empty
+
+    return (
+        all_fires_df['latitude'].to_numpy(),
+        all_fires_df['longitude'].to_numpy(),
+        # A missing FRP counts as 0 (as pandas .sum() did); a NaN would otherwise
+        # poison every district's total through the matrix product below
+        all_fires_df['frp'].fillna(0).to_numpy(),
+    )
+
+def calculate_local_impacts(fire_arrays):
+    """Counts fires (and their FRP) within ~55km of EVERY district in one pass."""
+    fire_lats, fire_lons, fire_frp = fire_arrays
+
+    # Approx 0.5 deg = 55km radius box, one row per district (DISTRICTS order)
+    lat_min, lat_max = DISTRICT_LATS[:, None] - 0.5, DISTRICT_LATS[:, None] + 0.5
+    lon_min, lon_max = DISTRICT_LONS[:, None] - 0.5, DISTRICT_LONS[:, None] + 0.5
+
+    # (districts x fires) boolean grid; an empty fire table just gives zeros
+    in_box = (
+        (fire_lats >= lat_min) & 
+        (fire_lats <= lat_max) & 
+        (fire_lons >= lon_min) & 
+        (fire_lons <= lon_max)
+    )
     
-    return len(local_fires), local_fires['frp'].sum()
+    return in_box.sum(axis=1), in_box @ fire_frp
 
 # --- 3. FETCH CITY DATA ---
-def fetch_city_data(city_name, lat, lon, all_fires_df, provincial_load):
-    # A. Local Fire Stats
-    local_count, local_intensity = calculate_local_impact(lat, lon, all_fires_df)
+def parse_openmeteo_wind(loc):
+    """Returns (speed, direction) from one OpenMeteo location, or None if it is incomplete."""
+    current = loc.get('current') if isinstance(loc, dict) else None
+    if not isinstance(current, dict):
+        return None
+    spd, deg = current.get('wind_speed_10m'), current.get('wind_direction_10m')
+    if spd is None or deg is None:
+        return None
+    return spd, deg
+
+def get_openmeteo_winds():
+    """Fetches current wind for ALL districts in one OpenMeteo call (Plan A)."""
+    params = {
+        "latitude": ",".join(map(str, DISTRICT_LATS.tolist())),
+        "longitude": ",".join(map(str, DISTRICT_LONS.tolist())),
+        **OPENMETEO_WIND_PARAMS
+    }
+    
+    try:
+        resp = HTTP.get(OPENMETEO_URL, params=params, timeout=30)
+        if resp.status_code == 200:
+            # Multi-location requests return a list, in the same order as the coordinates
+            # Read each location defensively: a bad entry only drops that district
+            # (which then retries OpenMeteo on its own), not the whole batch
+            winds = {}
+            for city, loc in zip(DISTRICT_NAMES, resp.json()):
+                wind = parse_openmeteo_wind(loc)
+                if wind is not None:
+                    winds[city] = wind
+            return winds
+        print(f"OpenMeteo batch failed: {resp.status_code}")
+    except API_ERRORS as e:
+        print(f"OpenMeteo batch failed: {e}")
+    return {}
+
+def get_openmeteo_wind(city_name, lat, lon):
+    """Single-district OpenMeteo call, for districts the batch didn't cover."""
+    params = {"latitude": lat, "longitude": lon, **OPENMETEO_WIND_PARAMS}
+    try:
+        resp = HTTP.get(OPENMETEO_URL, params=params, timeout=10)
+        if resp.status_code == 200:
+            return parse_openmeteo_wind(resp.json())
+    except API_ERRORS as e:
+        print(f"   OpenMeteo failed for {city_name}: {e}")
+    return None
 
-    # B. OpenWeather (Smog)
-    ow_url = f"http://api.openweathermap.org/data/2.5/air_pollution?lat={lat}&lon={lon}&appid={OPENWEATHER_KEY}"
+def fetch_city_data(city_name, lat, lon, primary_wind):
+    # A. OpenWeather (Smog)
+    owm_params = {"lat": lat, "lon": lon, "appid": OPENWEATHER_KEY}
     pm2_5, pm10 = None, None
     
     try:
-        resp = requests.get(ow_url, timeout=10)
+        resp = HTTP.get(f"{OWM_BASE_URL}/air_pollution", params=owm_params, timeout=10)
         if resp.status_code == 200:
             d = resp.json()['list'][0]['components']
             pm2_5, pm10 = d['pm2_5'], d['pm10']
-    except Exception as e:
+    except API_ERRORS as e:
         print(f"   Smog fetch failed for {city_name}: {e}")
 
 # ---------------------------------------------------------
-    # C. WIND DATA (Dual-Source Strategy)
+    # B. WIND DATA (Dual-Source Strategy)
     # ---------------------------------------------------------
-    wind_spd, wind_dir = None, None
-    
     # --- PRIMARY SOURCE: OpenMeteo ---
-    om_url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": lat, 
-        "longitude": lon, 
-        "current": "wind_speed_10m,wind_direction_10m",
-        "wind_speed_unit": "kmh"
-    }
-    
-    # Try OpenMeteo (Plan A)
-    try:
-        resp = requests.get(om_url, params=params, timeout=10)
-        if resp.status_code == 200:
-            data = resp.json()
-            if 'current' in data:
-                wind_spd = data['current']['wind_speed_10m']
-                wind_dir = data['current']['wind_direction_10m']
-    except Exception as e:
-        print(f"   OpenMeteo failed for {city_name}: {e}")
+    # Normally already fetched for every district in one batch (see get_openmeteo_winds).
+    # If the batch missed this district (timeout, 429/5xx, bad entry), retry OpenMeteo
+    # for just this district, so a batch failure doesn't push all 42 districts onto OWM
+    if primary_wind is None:
+        primary_wind = get_openmeteo_wind(city_name, lat, lon)
+    wind_spd, wind_dir = primary_wind if primary_wind is not None else (None, None)
 
     # --- SECONDARY SOURCE: OpenWeatherMap (Fallback) ---
     # If Plan A failed (wind_spd is still None), use Plan B
     if wind_spd is None:
         print(f"   Triggering Backup (OWM) for {city_name}...")
         # Note: We use the 'weather' endpoint, not 'air_pollution'
-        owm_url = f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={OPENWEATHER_KEY}&units=metric"
         
         try:
-            r = requests.get(owm_url, timeout=10)
+            r = HTTP.get(f"{OWM_BASE_URL}/weather", params={**owm_params, "units": "metric"}, timeout=10)
             if r.status_code == 200:
                 d = r.json()
                 # OWM gives speed in m/s, so we convert to km/h (x 3.6)
@@ -108,7 +189,7 @@ def fetch_city_data(city_name, lat, lon, all_fires_df, provincial_load):
                 print(f"   Backup Saved the day: {wind_spd:.1f} km/h")
             else:
                 print(f"   Backup also failed: {r.status_code}")
-        except Exception as e:
+        except API_ERRORS as e:
             print(f"   Backup Error: {e}")
             
     # --- FINAL SAFETY NET ---
@@ -118,81 +199,85 @@ def fetch_city_data(city_name, lat, lon, all_fires_df, provincial_load):
     if wind_dir is None: 
         wind_dir = 0.0
 
-    # Return the row
+    # Return the row (timestamp + fire columns are filled in by the pipeline)
     return {
-        # CRITICAL: We use 'now()' here, but we will floor it to the hour later
-        "timestamp": datetime.now(), 
         "district": city_name,
         "pm2_5": pm2_5,
         "pm10": pm10,
         "wind_speed": wind_spd,
-        "wind_dir": wind_dir,
-        "provincial_fire_load": provincial_load,
-        "local_fire_count": local_count,
-        "local_fire_frp": local_intensity
+        "wind_dir": wind_dir
     }
 
 # --- 4. MAIN PIPELINE (With Idempotency) ---
 def run_pipeline():
-    print(f"--- Starting Pipeline at {datetime.now()} ---")
-    
-    # Step 1: Fetch Provincial Context
-    all_fires_df = get_provincial_fires()
-    provincial_load = all_fires_df['frp'].sum() if not all_fires_df.empty else 0
-    print(f"Provincial Fire Load: {provincial_load} MW")
+    started_at = datetime.now()
+    print(f"--- Starting Pipeline at {started_at} ---")
 
-    # Step 2: Loop through Districts
-    batch_data = []
-    print(f"Processing {len(DISTRICTS)} districts...")
+    # DATA CLEANING: Floor the run's timestamp to the hour, once
+    # This ensures 10:05 and 10:55 both become "10:00:00"
+    # This allows our Primary Key (timestamp + district) to reject duplicates,
+    # and every district in the run shares it even if the loop crosses the hour
+    run_hour = started_at.replace(minute=0, second=0, microsecond=0)
     
-    for city, coords in DISTRICTS.items():
-        print(f"   Fetching {city}...")
-        row = fetch_city_data(city, coords['lat'], coords['lon'], all_fires_df, provincial_load)
-        batch_data.append(row)
-        time.sleep(1) # Respect API limits
+    batch_data = []
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # Step 1: Start the Provincial Context download in the background
+        # It doesn't depend on the weather calls, so it overlaps the district loop
+        fires_future = pool.submit(get_provincial_fires)
+
+        # Step 2: Wind for every district in a single call
+        winds = get_openmeteo_winds()
+
+        # Step 3: Loop through Districts
+        print(f"Processing {len(DISTRICTS)} districts...")
+        
+        for city, coords in DISTRICTS.items():
+            print(f"   Fetching {city}...")
+            row = fetch_city_data(city, coords['lat'], coords['lon'], winds.get(city))
+            batch_data.append(row)
+            time.sleep(1) # Respect API limits
+
+        all_fires_df = fires_future.result()
 
     if not batch_data:
         print("No data collected. Exiting.")
         return
 
-    # Step 3: Prepare Data for Database
+    fire_arrays = extract_fire_arrays(all_fires_df)
+    provincial_load = float(fire_arrays[2].sum())
+    print(f"Provincial Fire Load: {provincial_load} MW")
+
+    # Attach the run hour and Local Fire Stats to each district row
+    # (batch_data was built by looping DISTRICTS, so it lines up with DISTRICT_NAMES)
+    local_counts, local_intensities = calculate_local_impacts(fire_arrays)
+    for row, local_count, local_intensity in zip(batch_data, local_counts.tolist(), local_intensities.tolist()):
+        row['timestamp'] = run_hour
+        row['provincial_fire_load'] = provincial_load
+        row['local_fire_count'] = local_count
+        row['local_fire_frp'] = local_intensity
+
+    # Step 4: Prepare Data for Database
     print("Preparing Database Upload...")
-    df = pd.DataFrame(batch_data)
-    
-    # DATA CLEANING: Floor timestamp to the nearest hour
-    # This ensures 10:05 and 10:55 both become "10:00:00"
-    # This allows our Primary Key (timestamp + district) to reject duplicates
-    df['timestamp'] = pd.to_datetime(df['timestamp']).dt.floor('H')
     
     try:
         # Create Engine
         engine = create_engine(DB_CONNECTION_STR)
         
         with engine.connect() as conn:
-            # A. Upload to "Staging" (Temporary Table)
-            # 'if_exists="replace"' clears the staging table from any previous failed runs
-            df.to_sql('smog_staging', conn, if_exists='replace', index=False)
-            
-            # B. Perform the "Upsert" (Merge)
-            # This SQL moves data from Staging -> Main, IGNORING duplicates
-            merge_query = text("""
-                INSERT INTO smog_metrics (
-                    timestamp, district, pm2_5, pm10, wind_speed, wind_dir, 
-                    provincial_fire_load, local_fire_count, local_fire_frp
-                )
-                SELECT 
-                    timestamp, district, pm2_5, pm10, wind_speed, wind_dir, 
-                    provincial_fire_load, local_fire_count, local_fire_frp
-                FROM smog_staging
-                ON CONFLICT (timestamp, district) DO NOTHING;
-            """)
+            # Perform the "Upsert" directly against the main table
+            # SQLAlchemy batches all rows into a single multi-row INSERT,
+            # and Postgres skips any (timestamp, district) that already exists.
+            # No staging table means no DROP/CREATE + second copy every run.
+            upsert_query = insert(SMOG_METRICS).on_conflict_do_nothing(
+                index_elements=["timestamp", "district"]
+            )
             
-            conn.execute(merge_query)
+            conn.execute(upsert_query, batch_data)
             conn.commit() # Commit the transaction
             
-            print(f"SUCCESS: Processed {len(df)} rows. Duplicates were safely ignored.")
+            print(f"SUCCESS: Processed {len(batch_data)} rows. Duplicates were safely ignored.")
             
-    except Exception as e:
+    except SQLAlchemyError as e:
         print(f"DATABASE ERROR: {e}")
 
 if __name__ == "__main__":
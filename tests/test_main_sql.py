@@ -0,0 +1,124 @@
+import importlib
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def main_sql(monkeypatch):
+    # main_sql refuses to import without its keys, so give it dummy ones
+    monkeypatch.setenv("NASA_API_KEY", "test")
+    monkeypatch.setenv("OWM_API_KEY", "test")
+    monkeypatch.setenv("DATABASE_URL", "postgresql://test")
+    sys.modules.pop("main_sql", None)
+    return importlib.import_module("main_sql")
+
+
+def per_district_box(df, city_lat, city_lon):
+    """The original pandas filter: fires inside the 0.5 deg box around one city."""
+    local_fires = df[
+        (df['latitude'] >= city_lat - 0.5) &
+        (df['latitude'] <= city_lat + 0.5) &
+        (df['longitude'] >= city_lon - 0.5) &
+        (df['longitude'] <= city_lon + 0.5)
+    ]
+    return len(local_fires), local_fires['frp'].sum()
+
+
+def test_local_impacts_match_per_district_filter(main_sql):
+    # float64 coordinates, as pd.read_csv parses them; Lahore is 31.5204, 74.3587
+    lahore_lat, lahore_lon = 31.5204, 74.3587
+    fires = pd.DataFrame({
+        'latitude': [
+            31.52, 31.60, 31.45, 30.16, 33.68, 25.00,
+            lahore_lat + 0.5, lahore_lat - 0.5,   # exactly on the N/S edges
+            32.0204, 31.0204,                     # same edges as FIRMS 5-decimal values
+            32.02041, 31.02039,                   # just outside N/S
+            lahore_lat, lahore_lat,
+        ],
+        'longitude': [
+            74.36, 74.20, 74.50, 71.52, 73.05, 60.00,
+            lahore_lon, lahore_lon,
+            lahore_lon, lahore_lon,
+            lahore_lon, lahore_lon,
+            lahore_lon + 0.5, 74.85871,           # on the E edge / just outside it
+        ],
+        'frp': [5.5, np.nan, 12.25, 3.0, 8.75, 100.0, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 128.0],
+    })
+
+    counts, frps = main_sql.calculate_local_impacts(main_sql.extract_fire_arrays(fires))
+
+    # Sanity-check the edge fixtures: exact edges are in Lahore's box, just-outside ones aren't
+    # (the 5-decimal literals can land either side of the edge; only agreement matters for them)
+    in_lahore = (
+        fires['latitude'].between(lahore_lat - 0.5, lahore_lat + 0.5) &
+        fires['longitude'].between(lahore_lon - 0.5, lahore_lon + 0.5)
+    )
+    assert in_lahore[[6, 7, 12]].all()
+    assert not in_lahore[[10, 11, 13]].any()
+
+    for i, city in enumerate(main_sql.DISTRICT_NAMES):
+        coords = main_sql.DISTRICTS[city]
+        count, frp = per_district_box(fires, coords['lat'], coords['lon'])
+        assert counts[i] == count, city
+        assert frps[i] == pytest.approx(frp), city
+
+
+def test_local_impacts_with_no_fires(main_sql):
+    counts, frps = main_sql.calculate_local_impacts(main_sql.extract_fire_arrays(pd.DataFrame()))
+
+    assert counts.tolist() == [0] * len(main_sql.DISTRICTS)
+    assert frps.tolist() == [0.0] * len(main_sql.DISTRICTS)
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+
+def openmeteo_loc(spd, deg):
+    return {"current": {"wind_speed_10m": spd, "wind_direction_10m": deg}}
+
+
+def test_openmeteo_batch_drops_only_the_malformed_district(main_sql, monkeypatch):
+    locs = [openmeteo_loc(float(i), 90.0) for i in range(len(main_sql.DISTRICT_NAMES))]
+    locs[3] = {"error": True, "reason": "bad location"}
+    monkeypatch.setattr(main_sql.HTTP, "get", lambda *args, **kwargs: FakeResponse(locs))
+
+    winds = main_sql.get_openmeteo_winds()
+
+    bad_city = main_sql.DISTRICT_NAMES[3]
+    assert bad_city not in winds
+    assert len(winds) == len(main_sql.DISTRICT_NAMES) - 1
+    assert winds[main_sql.DISTRICT_NAMES[0]] == (0.0, 90.0)
+
+
+def test_openmeteo_batch_non_200_returns_no_winds(main_sql, monkeypatch):
+    monkeypatch.setattr(main_sql.HTTP, "get", lambda *args, **kwargs: FakeResponse(None, 429))
+
+    assert main_sql.get_openmeteo_winds() == {}
+
+
+def test_missing_batch_wind_retries_openmeteo_before_owm(main_sql, monkeypatch):
+    urls = []
+
+    def fake_get(url, **kwargs):
+        urls.append(url)
+        if url == main_sql.OPENMETEO_URL:
+            return FakeResponse(openmeteo_loc(12.5, 270.0))
+        if url.endswith("/air_pollution"):
+            return FakeResponse({"list": [{"components": {"pm2_5": 150.0, "pm10": 200.0}}]})
+        raise AssertionError(f"unexpected call to {url}")
+
+    monkeypatch.setattr(main_sql.HTTP, "get", fake_get)
+
+    row = main_sql.fetch_city_data("Lahore", 31.5204, 74.3587, None)
+
+    assert (row["wind_speed"], row["wind_dir"]) == (12.5, 270.0)
+    assert not any(url.endswith("/weather") for url in urls)